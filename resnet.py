@@ -14,22 +14,44 @@ import torch.nn.functional as F
 import torch.nn.init as init
 from torch.optim import SGD, Adam, Adagrad, RMSprop
 from torch.autograd import Variable
+from torch.nn.parallel import DistributedDataParallel as DDP
 
-__all__ = ['ResNet', 'resnet20', 'resnet32', 'resnet44', 'resnet56', 'resnet110', 'resnet1202']
+__all__ = ['ResNet', 'resnet20', 'resnet32', 'resnet44', 'resnet56', 'resnet110', 'resnet1202', 'wrap_ddp']
 
 def _weights_init(m):
-    classname = m.__class__.__name__
-    #print(classname)
-    if isinstance(m, nn.Linear) or isinstance(m, nn.Conv2d):
+    t = type(m)
+    if t is nn.Conv2d:
+        init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
+    elif t is nn.Linear:
         init.kaiming_normal_(m.weight)
 
-class LambdaLayer(nn.Module):
-    def __init__(self, lambd):
-        super(LambdaLayer, self).__init__()
-        self.lambd = lambd
+def _fuse_conv_bn(conv, bn):
+    """
+    Fold the running stats and affine params of bn into conv (eval only).
+    """
+    std = torch.sqrt(bn.running_var + bn.eps)
+    scale = bn.weight / std
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    conv.weight.data.mul_(scale.reshape(-1, 1, 1, 1))
+    conv.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+
+class OptionAShortcut(nn.Module):
+    """
+    Option A shortcut: subsample by 2 and zero-pad the channel dimension.
+    """
+    def __init__(self, pad):
+        super(OptionAShortcut, self).__init__()
+        self.pad = pad
 
     def forward(self, x):
-        return self.lambd(x)
+        y = x[:, :, ::2, ::2]
+        n, c, h, w = y.shape
+        out = torch.empty((n, c + 2 * self.pad, h, w), dtype=x.dtype, device=x.device,
+                          memory_format=torch.channels_last)
+        out[:, :self.pad].zero_()
+        out[:, self.pad:self.pad + c].copy_(y)
+        out[:, self.pad + c:].zero_()
+        return out
 
 
 class BasicBlock(nn.Module):
@@ -48,8 +70,7 @@ class BasicBlock(nn.Module):
                 """
                 For CIFAR10 ResNet paper uses option A.
                 """
-                self.shortcut = LambdaLayer(lambda x:
-                                            F.pad(x[:, :, ::2, ::2], (0, 0, 0, 0, planes//4, planes//4), "constant", 0))
+                self.shortcut = OptionAShortcut(planes//4)
             elif option == 'B':
                 self.shortcut = nn.Sequential(
                      nn.Conv2d(in_planes, self.expansion * planes, kernel_size=1, stride=stride, bias=False),
@@ -57,14 +78,20 @@ class BasicBlock(nn.Module):
                 )
 
     def forward(self, x):
-        out = F.relu(self.bn1(self.conv1(x)))
+        out = F.relu_(self.bn1(self.conv1(x)))
         out = self.bn2(self.conv2(out))
         out += self.shortcut(x)
-        out = F.relu(out)
+        out = F.relu_(out)
         return out
 
 
 class ResNet(nn.Module):
+    """
+    Weights are kept in channels_last (NHWC); feed inputs as
+    x.contiguous(memory_format=torch.channels_last) to skip the conversion.
+    Channel counts (16/32/64) are multiples of 8 so tensor cores engage under
+    mixed precision: with torch.autocast("cuda", dtype=torch.bfloat16): out = model(x)
+    """
     def __init__(self, block, num_blocks, num_classes=10):
         super(ResNet, self).__init__()
         self.in_planes = 16
@@ -76,7 +103,9 @@ class ResNet(nn.Module):
         self.layer3 = self._make_layer(block, 64, num_blocks[2], stride=2)
         self.linear = nn.Linear(64, num_classes)
 
-        self.apply(_weights_init)
+        with torch.no_grad():
+            self.apply(_weights_init)
+        self.to(memory_format=torch.channels_last)
 
     def _make_layer(self, block, planes, num_blocks, stride):
         strides = [stride] + [1]*(num_blocks-1)
@@ -87,39 +116,99 @@ class ResNet(nn.Module):
 
         return nn.Sequential(*layers)
 
+    @torch.no_grad()
+    def fuse_for_inference(self):
+        """
+        Fold every BatchNorm into its preceding conv and replace it with an
+        identity, so each block runs conv->relu->conv->add->relu.
+        Only valid in eval mode; the model cannot be trained afterwards.
+        """
+        self.eval()
+        pairs = [(self, 'conv1', 'bn1')]
+        for m in self.modules():
+            if isinstance(m, BasicBlock):
+                pairs += [(m, 'conv1', 'bn1'), (m, 'conv2', 'bn2')]
+        for m, conv_name, bn_name in pairs:
+            bn = getattr(m, bn_name)
+            if isinstance(bn, nn.BatchNorm2d):
+                _fuse_conv_bn(getattr(m, conv_name), bn)
+                setattr(m, bn_name, nn.Identity())
+        return self
+
+    def optimize_for_inference(self):
+        """
+        Script and freeze the model so the JIT conv-bn folding and
+        conv-add-relu fusion passes run. Returns a ScriptModule.
+        """
+        self.eval()
+        scripted = torch.jit.script(self)
+        scripted = torch.jit.freeze(scripted)
+        return torch.jit.optimize_for_inference(scripted)
+
     def forward(self, x):
-        out = F.relu(self.bn1(self.conv1(x)))
+        x = x.contiguous(memory_format=torch.channels_last)
+        out = F.relu_(self.bn1(self.conv1(x)))
         out = self.layer1(out)
         out = self.layer2(out)
         out = self.layer3(out)
-        out = F.avg_pool2d(out, out.size()[3])
-        out = out.view(out.size(0), -1)
+        out = F.adaptive_avg_pool2d(out, 1)
+        out = torch.flatten(out, 1)
         out = self.linear(out)
         return out
 
 
-def resnet20():
-    return ResNet(BasicBlock, [3, 3, 3])
+def _compile(model, compile_mode):
+    """
+    CUDA graphs ("reduce-overhead") need static input shapes, hence dynamic=False.
+    The model is put in eval mode; for training call .train() on it and pass
+    compile_mode="default" to avoid recompiles.
+    """
+    model.eval()
+    return torch.compile(model, mode=compile_mode, fullgraph=True, dynamic=False, backend="inductor")
+
+
+def _resnet(num_blocks, compile=False, compile_mode="reduce-overhead"):
+    model = ResNet(BasicBlock, num_blocks)
+    if compile:
+        model = _compile(model, compile_mode)
+    return model
+
+
+def resnet20(compile=False, compile_mode="reduce-overhead"):
+    return _resnet([3, 3, 3], compile, compile_mode)
+
+
+def resnet32(compile=False, compile_mode="reduce-overhead"):
+    return _resnet([5, 5, 5], compile, compile_mode)
 
 
-def resnet32():
-    return ResNet(BasicBlock, [5, 5, 5])
+def resnet44(compile=False, compile_mode="reduce-overhead"):
+    return _resnet([7, 7, 7], compile, compile_mode)
 
 
-def resnet44():
-    return ResNet(BasicBlock, [7, 7, 7])
+def resnet56(compile=False, compile_mode="reduce-overhead"):
+    return _resnet([9, 9, 9], compile, compile_mode)
 
 
-def resnet56():
-    return ResNet(BasicBlock, [9, 9, 9])
+def resnet110(compile=False, compile_mode="reduce-overhead"):
+    return _resnet([18, 18, 18], compile, compile_mode)
 
 
-def resnet110():
-    return ResNet(BasicBlock, [18, 18, 18])
+def resnet1202(compile=False, compile_mode="reduce-overhead"):
+    return _resnet([200, 200, 200], compile, compile_mode)
 
 
-def resnet1202():
-    return ResNet(BasicBlock, [200, 200, 200])
+def wrap_ddp(model, device):
+    """
+    Wrap model in DDP for multi-GPU training; the process group must already be
+    initialized. Allreduce overlaps with backward in 25MB buckets, and gradients
+    are views into those buckets. ResNet.forward is input-independent, so
+    static_graph is safe. Reach ResNet methods (e.g. fuse_for_inference)
+    through .module.
+    """
+    model = model.to(device)
+    return DDP(model, device_ids=[device], gradient_as_bucket_view=True,
+               bucket_cap_mb=25, static_graph=True)
 
 
 def test(net):
@@ -52,6 +52,8 @@ parser.add_argument('--pretrained', dest='pretrained', action='store_true',
                     help='use pre-trained model')
 parser.add_argument('--half', dest='half', action='store_true',
                     help='use half-precision(16-bit) ')
+parser.add_argument('--amp', dest='amp', action='store_true',
+                    help='use bfloat16 autocast mixed precision')
 parser.add_argument('--save-dir', dest='save_dir',
                     help='The directory used to save the trained models',
                     default='save_temp', type=str)
@@ -200,8 +202,9 @@ def train(train_loader, model, criterion, optimizer, epoch):
             input_var = input_var.half()
 
         # compute output
-        output = model(input_var)
-        loss = criterion(output, target_var)
+        with torch.autocast('cuda', dtype=torch.bfloat16, enabled=args.amp):
+            output = model(input_var)
+            loss = criterion(output, target_var)
 
         # compute gradient and do SGD step
         optimizer.zero_grad()
@@ -251,8 +254,9 @@ def validate(val_loader, model, criterion):
                 input_var = input_var.half()
 
             # compute output
-            output = model(input_var)
-            loss = criterion(output, target_var)
+            with torch.autocast('cuda', dtype=torch.bfloat16, enabled=args.amp):
+                output = model(input_var)
+                loss = criterion(output, target_var)
 
             output = output.float()
             loss = loss.float()